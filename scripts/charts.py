@@ -1,17 +1,15 @@
 """Functions to create charts"""
 
-import numpy as np
 import pandas as pd
 from bblocks.import_tools import world_bank
 import country_converter as coco
-from scripts import utils, config
-from scripts.config import urls
+from scripts import utils, config, glossaries, memory, polars_backend, store
 from scripts.download_data import (
-    get_emdat,
-    get_ndgain_data,
-    get_owid,
+    emdat_window,
+    get_emdat_cube,
     get_forest_area,
     get_global_temp,
+    get_gridded_temp,
     get_minerals,
     get_population,
 )
@@ -20,26 +18,32 @@ from scripts.download_data import (
 def gain() -> None:
     """Create ND-GAIN chart"""
 
-    df = get_ndgain_data()
+    store.ensure(["ndgain", "population"])
+    df = store.query(
+        """
+        SELECT g.iso_code, g.gain, g.vulnerability, g.readiness, p.population
+        FROM ndgain g
+        LEFT JOIN population p ON g.iso_code = p.iso_code
+        WHERE g.gain IS NOT NULL
+            AND g.vulnerability IS NOT NULL
+            AND g.readiness IS NOT NULL
+        """
+    )
+    df = df.pipe(utils.rank_by_year, "gain", year_col=None).sort_values("rank")
+
+    # add labels
     df = (
-        df.dropna(subset=["gain", "vulnerability", "readiness"])
-        .pipe(utils.add_income_levels)
+        df.pipe(utils.add_income_levels)
         .pipe(utils.add_debt_distress)
-        .assign(country=lambda d: coco.convert(d.iso_code, to="name_short"))
-        .assign(continent=lambda d: coco.convert(d.iso_code, to="continent"))
+        .pipe(utils.add_country_names)
+        .pipe(utils.add_region)
         .pipe(utils.highlight_category, "income_level", "Low income", True)
         .pipe(utils.highlight_category, "continent", "Africa", True)
-        .pipe(utils.add_pop_latest)
-    )
-
-    # format debt distress
-    df[df.debt_distress.isin(["Low", "Moderate"])] = np.nan
-    df.debt_distress = df.debt_distress.replace({"High": "High risk of debt distress"})
-
-    df = (
-        df.sort_values(by="gain", ascending=False)
-        .reset_index(drop=True)
-        .assign(rank=lambda d: d.index + 1)
+        .assign(
+            debt_distress=lambda d: d.debt_distress.mask(
+                d.debt_distress.isin(["Low", "Moderate"])
+            ).replace({"High": "High risk of debt distress"})
+        )
     )
 
     df = df[
@@ -78,64 +82,59 @@ def co2_per_capita_continent() -> None:
         "North America",
         "South America",
     ]
-    df = get_owid(urls.OWID_CO2_URL, ["co2_per_capita"])
-    (
-        df[(df.country.isin(continents)) & (df.year >= 1800)]
-        .pivot(index="year", columns="country", values="co2_per_capita")
-        .reset_index()
-        .to_csv(f"{config.paths.output}/co2_per_capita_continent.csv", index=False)
-    )
+    if config.BACKEND == "polars":
+        df = polars_backend.co2_per_capita_continent(continents)
+    else:
+        store.ensure(["owid_co2"])
+        df = store.query(
+            f"""
+            SELECT year, country, co2_per_capita
+            FROM owid_co2
+            WHERE year >= 1800 AND country IN ({", ".join("?" * len(continents))})
+            """,
+            tuple(continents),
+        ).pipe(
+            lambda d: d.pivot(
+                index="year", columns="country", values="co2_per_capita"
+            ).reset_index()
+        )
+
+    df.to_csv(f"{config.paths.output}/co2_per_capita_continent.csv", index=False)
 
 
-def climate_events(start_year=2020) -> None:
+def climate_events(
+    start_year=2020,
+    regions: tuple = ("Africa",),
+    *,
+    end_year: int | None = None,
+    name: str = "climate_events",
+) -> None:
     """Create climate event chart
 
     Args:
-        start_year (int): starting year. Default = 2000
+        start_year (int): starting year. Default = 2020
+        regions (tuple): continents to write a chart for. Default = Africa
+        end_year (int): last year. Default = latest year
+        name (str): output file name, before the region name
     """
 
-    df = get_emdat(start_year=start_year)
-
-    # calculate affected
-    affected = (
-        df[["year", "disaster_type", "iso_code", "total_affected"]]
-        .copy()
-        .groupby(["iso_code", "disaster_type"])
-        .agg("sum")
-        .reset_index()
-        .drop(columns="year")
-    )
+    cube = get_emdat_cube()
+    last_year = cube.columns.get_level_values(1).max()
+    end_year = last_year if end_year is None else min(end_year, last_year)
 
+    affected = emdat_window(cube, start_year, end_year)
     total_affected = (
         affected.groupby("iso_code", as_index=False)
         .agg("sum", numeric_only=True)
         .assign(disaster_type="Total")
     )
-    affected = pd.concat([affected, total_affected])
-
-    # calculate number of events
-    numb_events = (
-        df[["year", "disaster_type", "iso_code", "events"]]
-        .copy()
-        .groupby(["iso_code", "disaster_type"])
-        .agg("sum")
-        .reset_index()
-        .drop(columns="year")
-    )
-    total_events = (
-        numb_events.groupby("iso_code", as_index=False)
-        .agg("sum", numeric_only=True)
-        .assign(disaster_type="Total")
-    )
-    numb_events = pd.concat([numb_events, total_events])
-
-    # merge affected and events
-    dff = pd.merge(affected, numb_events)
+    # people affected as a share of the population in the last year of the window
+    dff = pd.concat([affected, total_affected]).assign(year=end_year)
 
     dff = (
-        dff.assign(country=lambda d: coco.convert(d.iso_code, to="name_short"))
-        .pipe(utils.per_capita, target_col="total_affected", percent=True)
-        .pipe(utils.filter_countries)
+        dff.pipe(
+            utils.per_capita, target_col="total_affected", year_col="year", percent=True
+        )
         .loc[
             lambda d: (
                 d.total_affected_per_capita >= 1
@@ -145,7 +144,32 @@ def climate_events(start_year=2020) -> None:
         .assign(total_affected=lambda d: d.total_affected.astype(int))
     )
 
-    dff.to_csv(f"{config.paths.output}/climate_events_africa.csv", index=False)
+    columns = ["iso_code", "disaster_type", "total_affected", "events", "country"]
+    utils.write_regions(
+        dff,
+        name,
+        regions,
+        enrich=lambda d, _: d.pipe(utils.add_country_names).loc[
+            :, columns + ["total_affected_per_capita"]
+        ],
+    )
+
+
+def climate_events_windows(
+    windows: tuple = (3, 5, 10, 20), regions: tuple = ("Africa",)
+) -> None:
+    """Create climate event charts for the last n years
+
+    Args:
+        windows (tuple): number of years in each window
+        regions (tuple): continents to write a chart for. Default = Africa
+    """
+
+    latest_year = get_emdat_cube().columns.get_level_values(1).max()
+    for window in windows:
+        climate_events(
+            latest_year - window + 1, regions, name=f"climate_events_{window}y"
+        )
 
 
 def electricity_cooking() -> None:
@@ -179,15 +203,36 @@ def electricity_cooking() -> None:
     df.to_csv(f"{config.paths.output}/electricity_cooking.csv", index=False)
 
 
-def renewable() -> None:
-    """Create renewable vs fossil fuel electricity generation chart"""
+def renewable(regions: tuple | None = None) -> None:
+    """Create renewable vs fossil fuel electricity generation chart
+
+    Args:
+        regions (tuple): additional continents to write a chart for.
+            The Africa chart is always written
+    """
 
-    variables = ["fossil_electricity", "renewables_electricity"]
-    df = get_owid(urls.OWID_ENERGY_URL, variables)
+    country_names = {
+        "Democratic Republic of Congo": "D.R.C",
+        "Sao Tome and Principe": "Sao Tome",
+        "Central African Republic": "C.A.R",
+    }
+
+    if config.BACKEND == "polars" and regions is None:
+        polars_backend.renewable(country_names).to_csv(
+            f"{config.paths.output}/renewables_v_fossil.csv", index=False
+        )
+        return
+
+    store.ensure(["owid_energy"])
+    df = store.query(
+        """
+        SELECT iso_code, country, year, fossil_electricity, renewables_electricity
+        FROM owid_energy
+        """
+    )
 
     df = (
         df.pipe(utils.get_latest, by=["iso_code", "country"], date_col="year")
-        .pipe(utils.filter_countries)
         .assign(
             share_renewables=lambda d: (
                 d.renewables_electricity
@@ -203,17 +248,15 @@ def renewable() -> None:
         )
         .melt(id_vars=["iso_code", "country", "year", "share_renewables"])
         .dropna(subset="value")
-        .sort_values("share_renewables", ascending=False)
-    )
-    df["country"] = df["country"].replace(
-        {
-            "Democratic Republic of Congo": "D.R.C",
-            "Sao Tome and Principe": "Sao Tome",
-            "Central African Republic": "C.A.R",
-        }
+        .sort_values("share_renewables", ascending=False, kind="stable")
+        .replace({"country": country_names})
     )
 
-    df.to_csv(f"{config.paths.output}/renewables_v_fossil.csv", index=False)
+    utils.filter_countries(df).to_csv(
+        f"{config.paths.output}/renewables_v_fossil.csv", index=False
+    )
+    if regions is not None:
+        utils.write_regions(df, "renewables_v_fossil", regions)
 
 
 def sahel_population() -> None:
@@ -225,71 +268,198 @@ def sahel_population() -> None:
         .head(20)
         .assign(pop_2022=lambda d: round(d[2022] / 1000, 0))
         .assign(pop_2050=lambda d: round(d[2050] / 1000, 0))
+        .astype({"pop_2022": "int", "pop_2050": "int"})
+        .pipe(utils.add_country_names, name_col="name")
+        .assign(Location=lambda d: d.name.fillna(d.Location))
+        .drop(columns=["iso_code", "name"])
     )
 
-    df = df.astype({"pop_2022": "int", "pop_2050": "int"})
-    df.Location = coco.convert(df.Location, to="name_short")
     df.to_csv(f"{config.paths.output}/sahel_population.csv", index=False)
 
 
-def forest_congo(congo_basin=("CMR", "CAF", "COD", "COG", "GAB", "GNQ")) -> None:
+def forest_congo(
+    congo_basin=("CMR", "CAF", "COD", "COG", "GAB", "GNQ"),
+    regions: tuple | None = None,
+) -> None:
     """Create Africa (Congo Basin) forest cover chart
 
     Args:
         congo_basin: (tuple): list of country iso3 codes in the Congo basin
+        regions (tuple): additional continents to write a chart for.
+            The Africa chart is always written
     """
 
-    df = get_forest_area().pipe(utils.filter_countries).assign(congo_basin=np.nan)
-
-    df.loc[df.iso_code.isin(congo_basin), "congo_basin"] = "congo_basin"
+    df = get_forest_area(geometries=False).assign(
+        congo_basin=lambda d: pd.Series("congo_basin", index=d.index).where(
+            d.iso_code.isin(congo_basin)
+        )
+    )
 
-    df.to_csv(f"{config.paths.output}/forest_area.csv", index=False)
+    # geometries are only added to the written rows
+    (
+        utils.filter_countries(df)
+        .pipe(utils.add_flourish_geometries, keep=utils.countries_in(["Africa"]))
+        .to_csv(f"{config.paths.output}/forest_area.csv", index=False)
+    )
+    if regions is not None:
+        utils.write_regions(
+            df,
+            "forest_area",
+            regions,
+            enrich=lambda d, region: utils.add_flourish_geometries(
+                d, keep=utils.countries_in([region])
+            ),
+        )
 
 
-def transition_minerals(
-    minerals: tuple = (
-        "Cobalt",
-        "Copper",
-        "Chromium (Cr2O3)",
-        "Manganese",
-        "Platinum",
-        "Aluminium",
-        "Lithium (Li2O)",
-    )
-) -> None:
+def transition_minerals(minerals: tuple = config.TRANSITION_MINERALS) -> None:
     """Create transition minerals chart
 
     Args:
         minerals (tuple): list of transition minerals to use
     """
 
-    df = get_minerals(minerals)
-    df.country = df.country.replace({"Congo, D.R.": "Congo, Dem. Rep."})
-    df["iso_code"] = coco.convert(df.country)
-    df["continent"] = coco.convert(df.iso_code, to="continent")
+    df = (
+        get_minerals(minerals)
+        .assign(iso_code=lambda d: glossaries.to_iso3(d.country, source="minerals"))
+        .pipe(utils.add_region)
+    )
 
     df.to_csv(f"{config.paths.output}/minerals.csv", index=False)
 
 
-def temperature() -> None:
-    """Create temperature chart"""
+def temperature(regions: tuple | None = None) -> None:
+    """Create temperature chart
 
-    get_global_temp().to_csv(
-        f"{config.paths.output}/temperature_change.csv", index=False
-    )
+    Args:
+        regions (tuple): continents to add to a regional temperature chart,
+            calculated from gridded data. Default = None (global only)
+    """
 
+    df = get_global_temp()
+    df.to_csv(f"{config.paths.output}/temperature_change.csv", index=False)
 
-def update_charts():
-    """Pipeline to update all charts"""
+    if regions is not None:
+        regional = (
+            get_gridded_temp(regions)
+            .pivot(index="year", columns="area", values="temp_change")
+            .round(2)
+            .reset_index()
+        )
+        df.merge(regional, on="year", how="left").to_csv(
+            f"{config.paths.output}/temperature_change_regional.csv", index=False
+        )
+
+
+# chart functions run by update_charts, in order
+CHARTS = {
+    "temperature": temperature,
+    "climate_events": climate_events,
+    "climate_events_windows": climate_events_windows,
+    "gain": gain,
+    "co2_per_capita_continent": co2_per_capita_continent,
+    # "sahel_population": sahel_population,
+    "electricity_cooking": electricity_cooking,
+    "renewable": renewable,
+    "transition_minerals": transition_minerals,
+    "forest_congo": forest_congo,
+}
+
+# store tables queried by each chart
+CHART_TABLES = {
+    "gain": ["ndgain", "population"],
+    "co2_per_capita_continent": ["owid_co2"],
+    "renewable": ["owid_energy"],
+}
+
+
+# charts sharing cached loaders, run together in low-memory mode
+SHARED_CACHES = [["climate_events", "climate_events_windows", "electricity_cooking"]]
+
+# rough peak memory (MB) each chart adds on top of the running process, used to
+# order stages and skip those which would not fit in the low-memory budget
+CHART_MEMORY_MB = {
+    "renewable": 600,
+    "co2_per_capita_continent": 600,
+    "electricity_cooking": 500,
+    "climate_events": 400,
+    "climate_events_windows": 100,
+    "gain": 300,
+    "forest_congo": 300,
+    "temperature": 100,
+    "transition_minerals": 100,
+}
+
+
+def _stage_memory(stage: list) -> float:
+    """returns the expected peak memory of a stage in MB"""
+
+    return sum(CHART_MEMORY_MB.get(name, 0) for name in stage)
+
+
+def _low_memory_stages(charts: list) -> list:
+    """
+    groups charts into stages, keeping charts which share cached loaders together.
+    Stages are ordered heaviest first, so that the largest stages run while the
+    process is smallest
+    """
 
-    temperature()
-    climate_events()
-    gain()
-    co2_per_capita_continent()
-    # sahel_population()
-    electricity_cooking()
-    renewable()
-    transition_minerals()
-    forest_congo()
+    stages = [[name for name in group if name in charts] for group in SHARED_CACHES]
+    grouped = {name for group in SHARED_CACHES for name in group}
+    stages += [[name] for name in charts if name not in grouped]
+
+    return sorted([s for s in stages if len(s) > 0], key=_stage_memory, reverse=True)
+
+
+def update_charts(
+    skip: tuple | list = (), memory_budget_mb: float | None = None
+) -> None:
+    """Pipeline to update all charts
+
+    Args:
+        skip (list): names of charts to skip, e.g. those failing the preflight
+        memory_budget_mb (float): run in low-memory mode with this memory budget.
+            Sources are ingested and cached frames released stage by stage.
+            Stages which are not expected to fit in the budget are skipped and
+            a MemoryError is raised once the other stages have run.
+            Default = None (all sources are ingested up front)
+    """
+
+    charts = [name for name in CHARTS if name not in skip]
+    for name in skip:
+        print(f"Skipping {name}")
+
+    if "gain" in charts:
+        glossaries.refresh_income_levels()
+
+    if memory_budget_mb is None:
+        stages = [charts]
+    else:
+        stages = _low_memory_stages(charts)
+
+    over_budget = []
+    for stage in stages:
+        if memory_budget_mb is not None and not memory.fits(
+            memory_budget_mb, _stage_memory(stage)
+        ):
+            print(f"Skipping {', '.join(stage)}: not expected to fit in memory budget")
+            over_budget += stage
+            continue
+
+        store.ingest_sources(
+            [table for name in stage for table in CHART_TABLES.get(name, [])]
+        )
+        for name in stage:
+            CHARTS[name]()
+
+        if memory_budget_mb is not None:
+            memory.release()
+            memory.check(memory_budget_mb, ", ".join(stage))
+
+    if len(over_budget) > 0:
+        raise MemoryError(
+            f"{', '.join(over_budget)} did not fit in the "
+            f"{memory_budget_mb:.0f} MB memory budget"
+        )
 
     print("successfully updated charts")
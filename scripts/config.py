@@ -25,9 +25,25 @@ class Paths:
     def glossaries(self):
         return os.path.join(self.project_dir, "glossaries")
 
+    @property
+    def snapshots(self):
+        return os.path.join(self.project_dir, "snapshots")
+
+    @property
+    def database(self):
+        return os.path.join(self.raw_data, "climate.db")
+
 
 paths = Paths(os.path.dirname(os.path.dirname(__file__)))
 
+# backend for chart transforms: "pandas" or "polars"
+BACKEND = os.environ.get("CHARTS_BACKEND", "pandas")
+
+# memory budget in MB for the low-memory update mode. Unset = normal mode
+MEMORY_BUDGET_MB = (
+    float(os.environ["MEMORY_BUDGET_MB"]) if "MEMORY_BUDGET_MB" in os.environ else None
+)
+
 
 class Urls:
     """Source urls"""
@@ -46,6 +62,10 @@ class Urls:
     def UN_POP_PROSPECTS(self):
         return "https://population.un.org/wpp/Download/Files/1_Indicators%20(Standard)/CSV_FILES/WPP2022_Demographic_Indicators_Medium.zip"
 
+    @property
+    def UN_POP_PROSPECTS_VARIANTS(self):
+        return "https://population.un.org/wpp/Download/Files/1_Indicators%20(Standard)/CSV_FILES/WPP2022_Demographic_Indicators_OtherVariants.zip"
+
     @property
     def MINERALS(self):
         return "https://www.world-mining-data.info/wmd/downloads/XLS/6.5.%20Share_of_World_Mineral_Production_2020_by_Countries.xlsx"
@@ -58,6 +78,18 @@ class Urls:
     def TEMPERATURE(self):
         return 'https://climate.metoffice.cloud/formatted_data/gmt_HadCRUT5.csv'
 
+    @property
+    def HADCRUT_GRID(self):
+        return "https://www.metoffice.gov.uk/hadobs/hadcrut5/data/HadCRUT.5.0.2.0/analysis/HadCRUT.5.0.2.0.analysis.anomalies.ensemble_mean.nc"
+
+    @property
+    def INCOME_LEVELS(self):
+        return "https://databank.worldbank.org/data/download/site-content/CLASS.xlsx"
+
+    @property
+    def DSA_LIST(self):
+        return "https://www.imf.org/external/Pubs/ft/dsa/DSAlist.pdf"
+
 
 urls = Urls()
 
@@ -66,3 +98,17 @@ CLIMATE_EVENTS = [
     "Storm",
     "Flood",
 ]  # 'Wildfire', 'Extreme temperature ', 'Insect infestation'
+
+TRANSITION_MINERALS = (
+    "Cobalt",
+    "Copper",
+    "Chromium (Cr2O3)",
+    "Manganese",
+    "Platinum",
+    "Aluminium",
+    "Lithium (Li2O)",
+)
+
+# OWID indicators stored for the charts, validated against the codebooks
+OWID_CO2_INDICATORS = ["co2_per_capita"]
+OWID_ENERGY_INDICATORS = ["fossil_electricity", "renewables_electricity"]
@@ -1,9 +1,12 @@
 """functions to extract data"""
 
+import os
+import numpy as np
 import pandas as pd
 from typing import Optional
-from scripts import utils, config
+from scripts import utils, config, glossaries
 from zipfile import ZipFile
+from functools import lru_cache
 
 
 def get_owid(url: str, indicators: Optional[list] = None) -> pd.DataFrame:
@@ -17,17 +20,18 @@ def get_owid(url: str, indicators: Optional[list] = None) -> pd.DataFrame:
         pd.DataFrame
     """
 
+    columns = None
+    if indicators is not None:
+        glossaries.validate_owid_indicators(url, indicators)
+        columns = ["iso_code", "country", "year"] + indicators
+
     try:
-        df = pd.read_csv(url)
+        df = pd.read_csv(url, usecols=columns, float_precision="round_trip")
     except ConnectionError:
         raise ConnectionError("Could not read OWID data")
 
-    if indicators is not None:
-        for indicator in indicators:
-            if indicator not in df.columns:
-                raise ValueError(f"{indicator} is not found in the dataset")
-
-        return df[["iso_code", "country", "year"] + indicators]
+    if columns is not None:
+        return df[columns]
 
     else:
         return df
@@ -87,30 +91,112 @@ def get_emdat(*, start_year: Optional[int] = 2000) -> pd.DataFrame:
     return df
 
 
-def _clean_ndgain(df: pd.DataFrame, index_name: str) -> pd.DataFrame:
+@lru_cache
+def get_emdat_cube(start_year: int = 1900) -> pd.DataFrame:
+    """Build cumulative totals of emdat data along years
+
+    Args:
+        start_year (int): Starting year. Default = 1900
+
+    Returns:
+        pd.DataFrame indexed by iso_code and disaster_type, with running totals
+        of total_affected and events for each year as (measure, year) columns
+    """
+
+    df = get_emdat(start_year=start_year)
+    years = range(df.year.min(), df.year.max() + 1)
+
+    return pd.concat(
+        {
+            measure: df.pivot_table(
+                index=["iso_code", "disaster_type"],
+                columns="year",
+                values=measure,
+                aggfunc="sum",
+                fill_value=0,
+            )
+            .reindex(columns=years, fill_value=0)
+            .cumsum(axis=1)
+            for measure in ["total_affected", "events"]
+        },
+        axis=1,
+    )
+
+
+def emdat_window(
+    cube: pd.DataFrame, start_year: int, end_year: Optional[int] = None
+) -> pd.DataFrame:
+    """Total affected and events between two years (inclusive) from an emdat cube
+
+    Args:
+        cube (pd.DataFrame): cube created by get_emdat_cube
+        start_year (int): first year of the window
+        end_year (int): last year of the window. Default = latest year
+
+    The window is clipped to the years in the cube.
+
+    Returns:
+        pd.DataFrame
+    """
+
+    years = cube.columns.get_level_values(1)
+    first, last = years.min(), years.max()
+    if end_year is not None and start_year > end_year:
+        raise ValueError(f"start_year {start_year} is after end_year {end_year}")
+    if start_year > last or (end_year or last) < first:
+        raise ValueError(
+            f"There is no data in the window {start_year}-{end_year or ''} "
+            f"(data covers {first}-{last})"
+        )
+    if end_year is None:
+        end_year = last
+
+    totals = cube.xs(min(end_year, last), axis=1, level=1)
+    if start_year > first:
+        totals = totals - cube.xs(start_year - 1, axis=1, level=1)
+
+    return totals.reset_index()
+
+
+def _clean_ndgain(
+    df: pd.DataFrame, index_name: str, all_years: bool = False
+) -> pd.DataFrame:
     """returns a clean dataframe with latest year data"
 
     Args:
         df (pd.DataFrame): pandas dataframe to clean
         index_name (str): name of index column
+        all_years (bool): return all years in long format. Default = False
 
     Returns:
         pd.DataFrame
     """
 
+    if all_years:
+        years = [col for col in df.columns if str(col).isdigit()]
+        return (
+            df[["ISO3"] + years]
+            .rename(columns={"ISO3": "iso_code"})
+            .melt(id_vars="iso_code", var_name="year", value_name=index_name)
+            .astype({"year": "int"})
+        )
+
     latest_year = df.columns[-1]
     return df[["ISO3", latest_year]].rename(
         columns={"ISO3": "iso_code", latest_year: index_name}
     )
 
 
-def read_ndgain_index(folder: ZipFile, index: str, path: str) -> pd.DataFrame:
+def read_ndgain_index(
+    folder: ZipFile, index: str, path: str, all_years: bool = False
+) -> pd.DataFrame:
     """parse folder structure and read csv for an indicator
 
     Args:
         folder (ZiplFile): zipped folder object
         index (str): index file name
         path (str): path to file
+        all_years (bool): return all years in long format. Default = False
 
     Returns:
         pd.DataFrame
@@ -120,22 +206,28 @@ def read_ndgain_index(folder: ZipFile, index: str, path: str) -> pd.DataFrame:
         raise ValueError(f"Invalid path for {index}: {path}{index}")
 
     df = pd.read_csv(folder.open(f"{path}{index}.csv"), low_memory=False).pipe(
-        _clean_ndgain, index
+        _clean_ndgain, index, all_years
     )
 
     return df
 
 
-def get_ndgain_data() -> pd.DataFrame:
+def get_ndgain_data(all_years: bool = False) -> pd.DataFrame:
     """pipeline to extract all relevant nd-gain data
 
+    Args:
+        all_years (bool): return the full country x year panel instead of the
+            latest year only. Default = False
+
     Returns:
         pd.DataFrame
     """
 
     folder = utils.unzip_folder(config.urls.ND_GAIN)
+    on = ["iso_code", "year"] if all_years else "iso_code"
 
-    df = read_ndgain_index(folder, "gain", "resources/gain/")  # get main gain index
+    # get main gain index
+    df = read_ndgain_index(folder, "gain", "resources/gain/", all_years)
 
     # vulnerability
     vulnerability_indicators = [
@@ -148,18 +240,22 @@ def get_ndgain_data() -> pd.DataFrame:
         "habitat",
     ]
     for vul_index in vulnerability_indicators:
-        df_index = read_ndgain_index(folder, vul_index, "resources/vulnerability/")
+        df_index = read_ndgain_index(
+            folder, vul_index, "resources/vulnerability/", all_years
+        )
         if len(df) != len(df_index):
             raise ValueError("wrong length")
-        df = pd.merge(df, df_index, on="iso_code", how="left")
+        df = pd.merge(df, df_index, on=on, how="left")
 
     # readiness
     readiness_indicators = ["readiness", "economic", "governance"]
     for readiness_index in readiness_indicators:
-        df_index = read_ndgain_index(folder, readiness_index, "resources/readiness/")
+        df_index = read_ndgain_index(
+            folder, readiness_index, "resources/readiness/", all_years
+        )
         if len(df) != len(df_index):
             raise ValueError("wrong length")
-        df = pd.merge(df, df_index, on="iso_code", how="left")
+        df = pd.merge(df, df_index, on=on, how="left")
 
     return df
 
@@ -182,52 +278,279 @@ def get_global_temp() -> pd.DataFrame:
     return df
 
 
-def get_population(variant: str = "Medium") -> pd.DataFrame:
-    """Extract population data from UN World Population Prospects
+def get_gridded_temp(
+    regions: tuple = ("Africa",),
+    countries: tuple = (),
+    by: str = "continent",
+    chunk_months: int = 120,
+    baseline: tuple = (1850, 1900),
+) -> pd.DataFrame:
+    """Regional and country temperature anomalies from the gridded HadCRUT5 data
+
+    The NetCDF file is read lazily, chunk_months at a time, and each chunk is
+    reduced to area-weighted (cosine latitude) means with precomputed masks.
+    The gridded anomalies are relative to 1961-1990; each series is shifted to
+    the baseline period so that it can be compared with the global series.
+    Only years with valid data for all 12 months are kept.
 
     Args:
-        variant (str): variant level. Default = Medium
+        regions (tuple): regions to calculate. Default = Africa
+        countries (tuple): iso3 codes of countries to calculate
+        by (str): region category - 'continent', 'UNregion' etc.
+        chunk_months (int): number of months read at a time. Default = 120
+        baseline (tuple): first and last year of the reference period.
+            Default = 1850-1900, as in the global series
 
     Returns:
-        pd.DataFrame
+        pd.DataFrame with year, area and temp_change columns
     """
 
-    rename_countries = {
-        "China, Hong Kong SAR": "Hong Kong",
-        "China, Taiwan Province of China": "Taiwan",
-        "China, Macao SAR": "Macao",
-    }
+    try:
+        import xarray as xr
+    except ImportError:
+        raise ImportError("xarray and netCDF4 are required for gridded temperature")
+
+    path = f"{config.paths.raw_data}/hadcrut5_grid.nc"
+    if not os.path.exists(path):
+        utils.download_file(config.urls.HADCRUT_GRID, path)
+
+    with xr.open_dataset(path) as ds:
+        lat, lon = ds.latitude.values, ds.longitude.values
+        iso_codes, masks = utils.get_grid_masks(lat, lon)
+
+        areas = {}
+        for region in regions:
+            members = [
+                iso_codes.index(iso)
+                for iso in utils.countries_in([region], by)
+                if iso in iso_codes
+            ]
+            areas[region] = masks[members].sum(axis=0).clip(max=1)
+        areas.update({iso: masks[iso_codes.index(iso)] for iso in countries})
+        weights = np.stack(list(areas.values())) * np.cos(np.deg2rad(lat))[:, None]
+        weights = weights.reshape(len(areas), -1).T
+
+        means = []
+        for start in range(0, ds.sizes["time"], chunk_months):
+            block = ds.tas_mean[start : start + chunk_months].values
+            block = block.reshape(len(block), -1)
+            valid = ~np.isnan(block)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                means.append((np.where(valid, block, 0) @ weights) / (valid @ weights))
+
+        years = ds.time.dt.year.values
+
+    monthly = pd.DataFrame(np.vstack(means), columns=list(areas)).groupby(years)
+    annual = monthly.mean().where(monthly.count() == 12)
+    annual = annual - annual.loc[baseline[0] : baseline[1]].mean()
+
+    return (
+        annual.rename_axis("year")
+        .reset_index()
+        .melt(id_vars="year", var_name="area", value_name="temp_change")
+        .dropna(subset=["temp_change"])
+        .reset_index(drop=True)
+    )
+
+
+def get_wpp() -> pd.DataFrame:
+    """Extract demographic indicators from UN World Population Prospects
+
+    Returns:
+        pd.DataFrame
+    """
 
     folder = utils.unzip_folder(config.urls.UN_POP_PROSPECTS)
-    df = pd.read_csv(
+    return pd.read_csv(
         folder.open("WPP2022_Demographic_Indicators_Medium.csv"), low_memory=False
     )
 
+
+def _read_wpp_population(url: str, filename: str) -> pd.DataFrame:
+    """read the population columns of a WPP indicators file"""
+
+    folder = utils.unzip_folder(url)
+    return pd.read_csv(
+        folder.open(filename),
+        usecols=["LocID", "Location", "Variant", "Time", "TPopulation1Jan"],
+        dtype={"LocID": "int32", "Time": "int16", "TPopulation1Jan": "float64"},
+    )
+
+
+def _build_population_cube() -> dict:
+    """Build a (location, variant, year) array of population on 1 January
+
+    Estimates before the first projection year are only published with the
+    Medium variant, so they are copied to every other variant.
+    """
+
+    df = pd.concat(
+        [
+            _read_wpp_population(
+                config.urls.UN_POP_PROSPECTS,
+                "WPP2022_Demographic_Indicators_Medium.csv",
+            ),
+            _read_wpp_population(
+                config.urls.UN_POP_PROSPECTS_VARIANTS,
+                "WPP2022_Demographic_Indicators_OtherVariants.csv",
+            ),
+        ],
+        ignore_index=True,
+    )
+
+    loc_ids, loc_idx = np.unique(df.LocID.to_numpy(), return_inverse=True)
+    variants, variant_idx = np.unique(df.Variant.to_numpy(str), return_inverse=True)
+    years = np.arange(df.Time.min(), df.Time.max() + 1)
+    locations = df.groupby("LocID").Location.first().reindex(loc_ids).to_numpy(str)
+
+    values = np.full((len(loc_ids), len(variants), len(years)), np.nan)
+    values[loc_idx, variant_idx, df.Time.to_numpy() - years[0]] = df.TPopulation1Jan
+
+    medium = values[:, variants.tolist().index("Medium"), :]
+    for v in range(len(variants)):
+        first_year = np.argmax(~np.isnan(values[:, v, :]).all(axis=0))
+        values[:, v, :first_year] = medium[:, :first_year]
+
+    return {
+        "loc_ids": loc_ids,
+        "locations": locations,
+        "variants": variants,
+        "years": years,
+        "values": values,
+        "sources": np.array(_population_cube_sources()),
+    }
+
+
+def _population_cube_sources() -> list:
+    """returns the urls the population cube is built from"""
+
+    return [config.urls.UN_POP_PROSPECTS, config.urls.UN_POP_PROSPECTS_VARIANTS]
+
+
+@lru_cache
+def get_population_cube(refresh: bool = False) -> dict:
+    """Population on 1 January from UN World Population Prospects, in every
+    variant and year (1950-2100), as numpy arrays.
+
+    The cube is built once from the WPP files and cached in the raw data folder.
+    It is rebuilt when the source urls change.
+
+    Args:
+        refresh (bool): rebuild the cube from the WPP files. Default = False
+
+    Returns:
+        dict with loc_ids, locations, variants, years and values, an array of
+        shape (location, variant, year)
+    """
+
+    path = f"{config.paths.raw_data}/wpp_population.npz"
+    if not refresh and os.path.exists(path):
+        with np.load(path) as cached:
+            sources = cached["sources"].tolist() if "sources" in cached else []
+            if sources == _population_cube_sources():
+                return {key: cached[key] for key in cached.files}
+
+    cube = _build_population_cube()
+    np.savez_compressed(path, **cube)
+
+    return cube
+
+
+def population_growth(
+    start_year: int,
+    end_year: int,
+    variants: Optional[list] = None,
+    base_variant: Optional[str] = None,
+) -> pd.DataFrame:
+    """Population growth between two years for every location and variant
+
+    Args:
+        start_year (int): first year
+        end_year (int): last year
+        variants (list): variants to calculate. Default = all variants
+        base_variant (str): variant used for the start year population, to
+            compare variants against a common baseline. Default = same variant
+
+    Returns:
+        pd.DataFrame with LocID, Location, Variant, start_year, end_year and
+        change (percent) columns
+    """
+
+    cube = get_population_cube()
+    years = cube["years"].tolist()
+    all_variants = cube["variants"].tolist()
+    for year in (start_year, end_year):
+        if year not in years:
+            raise ValueError(f"{year} is not in the WPP data ({years[0]}-{years[-1]})")
+
+    if variants is None:
+        variants = all_variants
+    v = [all_variants.index(variant) for variant in variants]
+
+    end = cube["values"][:, v, years.index(end_year)]
+    if base_variant is None:
+        start = cube["values"][:, v, years.index(start_year)]
+    else:
+        start = cube["values"][
+            :, [all_variants.index(base_variant)], years.index(start_year)
+        ]
+        start = np.broadcast_to(start, end.shape)
+
+    n = len(cube["loc_ids"])
+    return pd.DataFrame(
+        {
+            "LocID": np.repeat(cube["loc_ids"], len(v)),
+            "Location": np.repeat(cube["locations"], len(v)),
+            "Variant": np.tile(np.asarray(variants), n),
+            start_year: start.ravel(),
+            end_year: end.ravel(),
+            "change": ((end - start) / start * 100).ravel(),
+        }
+    )
+
+
+def get_population(
+    variant: str = "Medium", start_year: int = 2022, end_year: int = 2050
+) -> pd.DataFrame:
+    """Extract population data from UN World Population Prospects
+
+    Args:
+        variant (str): variant level. Default = Medium
+        start_year (int): first year. Default = 2022
+        end_year (int): last year. Default = 2050
+
+    Returns:
+        pd.DataFrame
+    """
+
     df = (
-        df.loc[(df.Variant == variant) & (df.Time.isin([2022, 2050]))]
-        .reset_index(drop=True)
+        population_growth(start_year, end_year, variants=[variant])
         .pipe(utils.keep_countries, mapping_col="LocID", mapper="ISOnumeric")
-        .replace(rename_countries)
-        .pivot(index="Location", columns="Time", values="TPopulation1Jan")
-        .reset_index()
-        .assign(change=lambda d: ((d[2050] - d[2022]) / d[2022]) * 100)
+        .assign(iso_code=lambda d: utils.codes_to_iso3(d.LocID))
+        .filter(["iso_code", "Location", start_year, end_year, "change"], axis=1)
+        .sort_values("Location")
+        .reset_index(drop=True)
     )
 
     return df
 
 
-def get_forest_area() -> pd.DataFrame:
+def get_forest_area(geometries: bool = True) -> pd.DataFrame:
     """Extract forest area data from WDI
 
+    Args:
+        geometries (bool): add flourish geometries. Default = True
+
     Returns:
         pd.DataFrame
     """
 
-    df = (
-        utils.get_wb_indicator("AG.LND.FRST.ZS")
-        .pipe(utils.get_latest, by=["iso_code", "country_name"], date_col="year")
-        .pipe(utils.add_flourish_geometries)
+    df = utils.get_wb_indicator("AG.LND.FRST.ZS").pipe(
+        utils.get_latest, by=["iso_code", "country_name"], date_col="year"
     )
+    if geometries:
+        df = df.pipe(utils.add_flourish_geometries)
+
     return df
 
 
@@ -0,0 +1,267 @@
+"""Registry of lookup files in the glossaries folder
+
+Each glossary is read once, on first use, and kept in memory as an indexed
+structure for the rest of the session.
+"""
+
+import datetime
+import json
+import os
+from functools import lru_cache
+
+import country_converter as coco
+import pandas as pd
+
+from scripts import config
+
+OWID_CODEBOOKS = {
+    config.urls.OWID_CO2_URL: "OWID_CO2_codes.csv",
+    config.urls.OWID_ENERGY_URL: "OWID_energy_codes.csv",
+}
+
+
+def _versions_path() -> str:
+    return f"{config.paths.glossaries}/versions.json"
+
+
+def _read_versions() -> dict:
+    """returns the version record of refreshed glossaries"""
+
+    if not os.path.exists(_versions_path()):
+        return {}
+
+    with open(_versions_path()) as file:
+        return json.load(file)
+
+
+# ==============================================
+# OWID codebooks
+# ==============================================
+
+
+@lru_cache
+def owid_codebook(url: str) -> pd.DataFrame:
+    """Codebook of an OWID dataset, indexed by column name
+
+    Args:
+        url (str): url of the OWID dataset
+
+    Returns:
+        pd.DataFrame
+    """
+
+    if url not in OWID_CODEBOOKS:
+        raise ValueError(f"There is no codebook for {url}")
+
+    return pd.read_csv(
+        f"{config.paths.glossaries}/{OWID_CODEBOOKS[url]}", index_col="column"
+    )
+
+
+def validate_owid_indicators(url: str, indicators: list) -> None:
+    """Raise an error if any indicator is not in the codebook of an OWID dataset"""
+
+    codebook = owid_codebook(url)
+    for indicator in indicators:
+        if indicator not in codebook.index:
+            raise ValueError(f"{indicator} is not found in the dataset")
+
+
+# ==============================================
+# Income levels
+# ==============================================
+
+
+@lru_cache
+def income_levels() -> pd.Series:
+    """World Bank income levels, indexed by iso3 code"""
+
+    return pd.read_csv(
+        f"{config.paths.glossaries}/income_levels.csv", index_col="Code"
+    ).loc[:, "Income group"]
+
+
+def refresh_income_levels(max_age_days: int = 365) -> None:
+    """Download income levels from the World Bank if the local copy is outdated
+
+    The local copy is kept if the download fails.
+
+    Args:
+        max_age_days (int): maximum age of the local copy. Default = 365
+    """
+
+    version = _read_versions().get("income_levels")
+    if version is not None:
+        updated = datetime.date.fromisoformat(version["updated"])
+        if (datetime.date.today() - updated).days <= max_age_days:
+            return
+
+    try:
+        df = pd.read_excel(
+            config.urls.INCOME_LEVELS,
+            sheet_name="List of economies",
+            usecols=["Code", "Income group"],
+            na_values=None,
+        ).dropna(subset=["Income group"])
+    except (OSError, ValueError) as error:
+        print(f"Could not refresh income levels, using the local copy: {error}")
+        return
+    df.to_csv(f"{config.paths.glossaries}/income_levels.csv", index=False)
+
+    versions = _read_versions()
+    versions["income_levels"] = {
+        "updated": datetime.date.today().isoformat(),
+        "source": config.urls.INCOME_LEVELS,
+    }
+    with open(_versions_path(), "w") as file:
+        json.dump(versions, file, indent=2)
+
+    income_levels.cache_clear()
+    print("Successfully refreshed income levels")
+
+
+# ==============================================
+# Flourish geometries
+# ==============================================
+
+
+@lru_cache
+def flourish_geometries() -> pd.DataFrame:
+    """Flourish world geometries with one row per iso3 code"""
+
+    g = pd.read_json(f"{config.paths.glossaries}/flourish_geometries_world.json")
+
+    return (
+        g.rename(columns={g.columns[0]: "flourish_geom", g.columns[1]: "iso_code"})
+        .iloc[1:]
+        .drop_duplicates(subset="iso_code", keep="first")
+        .reset_index(drop=True)
+    )
+
+
+# ==============================================
+# Country names
+# ==============================================
+
+
+def _country_names_path() -> str:
+    return f"{config.paths.glossaries}/country_names.csv"
+
+
+def _unresolved_names_path() -> str:
+    return f"{config.paths.glossaries}/unresolved_names.csv"
+
+
+@lru_cache
+def country_names() -> dict:
+    """Learned mappings of country names to iso3 codes"""
+
+    if not os.path.exists(_country_names_path()):
+        return {}
+
+    return (
+        pd.read_csv(_country_names_path(), keep_default_na=False)
+        .set_index("name")
+        .loc[:, "iso_code"]
+        .to_dict()
+    )
+
+
+@lru_cache
+def _exact_names() -> dict:
+    """returns a mapping of lower case coco names and codes to iso3 codes"""
+
+    data = coco.CountryConverter().data
+    lookup = {}
+    for column in ["ISO3", "name_official", "name_short"]:
+        lookup.update(
+            {str(k).lower(): iso for k, iso in zip(data[column], data["ISO3"])}
+        )
+
+    return lookup
+
+
+def _match_names(names: list) -> dict:
+    """returns iso3 codes of names by exact lookup, then coco regex matching"""
+
+    exact = _exact_names()
+    matched = {n: exact[n.lower()] for n in names if n.lower() in exact}
+
+    unmatched = [n for n in names if n not in matched]
+    if len(unmatched) > 0:
+        codes = coco.CountryConverter().convert(
+            unmatched, to="ISO3", not_found="not found"
+        )
+        codes = [codes] if len(unmatched) == 1 else codes
+        matched.update(
+            {
+                n: c
+                for n, c in zip(unmatched, codes)
+                if isinstance(c, str) and c != "not found"
+            }
+        )
+
+    return matched
+
+
+def _unresolved_names() -> pd.DataFrame:
+    """returns the names waiting for review"""
+
+    if not os.path.exists(_unresolved_names_path()):
+        return pd.DataFrame(columns=["name", "source"])
+
+    return pd.read_csv(_unresolved_names_path(), keep_default_na=False)
+
+
+def _record_unresolved(names: list, source: str) -> None:
+    """append names which could not be resolved to the review file"""
+
+    (
+        pd.DataFrame({"name": names, "source": source})
+        .pipe(lambda d: pd.concat([_unresolved_names(), d]))
+        .drop_duplicates()
+        .sort_values(["source", "name"])
+        .to_csv(_unresolved_names_path(), index=False)
+    )
+
+
+def to_iso3(
+    names: pd.Series, not_found: str = "not found", source: str = ""
+) -> pd.Series:
+    """Convert country names to iso3 codes
+
+    Names are looked up in the learned mappings in country_names.csv. Only
+    unseen names are matched with country_converter, and new matches are saved
+    to the learned mappings. Names which cannot be matched are recorded in
+    unresolved_names.csv and are not matched again until they are reviewed
+    (added to country_names.csv and removed from unresolved_names.csv).
+
+    Args:
+        names (pd.Series): country names
+        not_found (str): value for names which cannot be resolved
+        source (str): source of the names, recorded with unresolved names
+
+    Returns:
+        pd.Series of iso3 codes
+    """
+
+    known = country_names()
+    skip = known.keys() | set(_unresolved_names().name)
+    unseen = [n for n in names.dropna().unique() if n not in skip]
+
+    if len(unseen) > 0:
+        learned = _match_names(unseen)
+        if len(learned) > 0:
+            mappings = sorted({**known, **learned}.items())
+            pd.DataFrame(mappings, columns=["name", "iso_code"]).to_csv(
+                _country_names_path(), index=False
+            )
+            country_names.cache_clear()
+            known = country_names()
+
+        unresolved = [n for n in unseen if n not in learned]
+        if len(unresolved) > 0:
+            print(f"Could not resolve {len(unresolved)} name(s): {unresolved}")
+            _record_unresolved(unresolved, source)
+
+    return names.map(known).fillna(not_found)
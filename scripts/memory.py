@@ -0,0 +1,72 @@
+"""Memory helpers for the low-memory update mode"""
+
+import ctypes
+import gc
+import os
+
+from scripts import download_data, utils
+
+# cached loaders holding large frames, released between charts
+CACHED_LOADERS = [
+    download_data.get_emdat_cube,
+    download_data.get_population_cube,
+    utils.get_pop_panel,
+]
+
+
+def rss_mb() -> float | None:
+    """returns the current resident set size of the process in MB, or None if it
+    cannot be read"""
+
+    try:
+        with open("/proc/self/statm") as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def release() -> None:
+    """Clear cached loaders and return freed memory to the operating system"""
+
+    for loader in CACHED_LOADERS:
+        loader.cache_clear()
+    gc.collect()
+
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def fits(budget_mb: float, expected_mb: float) -> bool:
+    """Release memory and check whether a stage expected to use expected_mb more
+    fits in the budget. Always True if memory usage cannot be read
+
+    Args:
+        budget_mb (float): memory budget in MB
+        expected_mb (float): expected peak memory of the stage in MB
+    """
+
+    release()
+    usage = rss_mb()
+
+    return usage is None or usage + expected_mb <= budget_mb
+
+
+def check(budget_mb: float, stage: str) -> None:
+    """Print memory usage after a stage and warn if it is over budget
+
+    Args:
+        budget_mb (float): memory budget in MB
+        stage (str): name of the stage that just finished
+    """
+
+    usage = rss_mb()
+    if usage is None:
+        print(f"Memory after {stage}: unknown")
+        return
+
+    print(f"Memory after {stage}: {usage:.0f} MB")
+    if usage > budget_mb:
+        print(f"Warning: memory usage is over the {budget_mb:.0f} MB budget")
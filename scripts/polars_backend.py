@@ -0,0 +1,108 @@
+"""Polars implementation of chart transforms
+
+Sources are scanned lazily as Arrow-backed query plans so that column
+selections and row filters are pushed down into the csv scan, and each chart
+executes multi-threaded in a single collect. Results are returned as pandas
+dataframes matching the pandas implementation in charts.py.
+
+Select this backend with the CHARTS_BACKEND=polars environment variable.
+Polars and pyarrow are optional dependencies.
+"""
+
+from scripts import glossaries, utils, config
+
+
+def _polars():
+    """import polars, which is an optional dependency"""
+
+    try:
+        import polars as pl
+        import pyarrow  # noqa: F401  needed to convert results to pandas
+    except ImportError:
+        raise ImportError("polars and pyarrow are required for the polars backend")
+
+    return pl
+
+
+def scan_owid(url: str, indicators: list):
+    """Lazily scan an OWID dataset
+
+    Args:
+        url (str): url to csv file
+        indicators (list): list of indicators to extract
+
+    Returns:
+        pl.LazyFrame
+    """
+
+    pl = _polars()
+    glossaries.validate_owid_indicators(url, indicators)
+
+    return pl.scan_csv(url, infer_schema_length=None).select(
+        ["iso_code", "country", "year"] + indicators
+    )
+
+
+def co2_per_capita_continent(continents: list):
+    """CO2 emissions per capita by continent
+
+    Args:
+        continents (list): continents to keep
+
+    Returns:
+        pd.DataFrame
+    """
+
+    pl = _polars()
+
+    df = (
+        scan_owid(config.urls.OWID_CO2_URL, config.OWID_CO2_INDICATORS)
+        .filter((pl.col("year") >= 1800) & pl.col("country").is_in(continents))
+        .collect()
+        .pivot(on="country", index="year", values="co2_per_capita")
+        .sort("year")
+    )
+
+    return df.select(["year"] + sorted(df.columns[1:])).to_pandas()
+
+
+def renewable(country_names: dict):
+    """Renewable vs fossil fuel electricity generation for African countries
+
+    Args:
+        country_names (dict): country names to replace
+
+    Returns:
+        pd.DataFrame
+    """
+
+    pl = _polars()
+    return (
+        scan_owid(config.urls.OWID_ENERGY_URL, config.OWID_ENERGY_INDICATORS)
+        .filter(pl.col("iso_code").is_in(utils.countries_in(["Africa"])))
+        .sort(["iso_code", "country", "year"])
+        .group_by(["iso_code", "country"], maintain_order=True)
+        .agg(pl.all().drop_nulls().last())
+        .with_columns(
+            share_renewables=(
+                pl.col("renewables_electricity")
+                / (pl.col("fossil_electricity") + pl.col("renewables_electricity"))
+                * 100
+            ).fill_nan(None)
+        )
+        .rename(
+            {
+                "renewables_electricity": "renewables",
+                "fossil_electricity": "fossil fuels",
+            }
+        )
+        .unpivot(
+            on=["fossil fuels", "renewables"],
+            index=["iso_code", "country", "year", "share_renewables"],
+        )
+        .filter(pl.col("value").is_not_null() & pl.col("value").is_not_nan())
+        .sort("share_renewables", descending=True, nulls_last=True, maintain_order=True)
+        .with_columns(pl.col("country").replace(country_names))
+        .collect()
+        .to_pandas()
+    )
@@ -0,0 +1,171 @@
+"""Preflight checks for source urls
+
+Every source url is checked concurrently with a HEAD request (or a one byte
+range request when HEAD is not supported) before any heavy work starts. The
+results are compared with the previous run so that moved endpoints or sources
+which suddenly return HTML are caught before downloading anything.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from scripts import charts, config
+
+HEADERS = {"User-Agent": "Chrome/108.0.5359.124"}
+TIMEOUT = 30
+
+# charts that depend on each source in config.Urls
+SOURCE_CHARTS = {
+    "OWID_CO2_URL": ["co2_per_capita_continent"],
+    "OWID_ENERGY_URL": ["renewable"],
+    "UN_POP_PROSPECTS": ["sahel_population"],
+    "UN_POP_PROSPECTS_VARIANTS": ["sahel_population"],
+    "MINERALS": ["transition_minerals"],
+    "ND_GAIN": ["gain"],
+    "TEMPERATURE": ["temperature"],
+    "HADCRUT_GRID": [],  # only used for optional regional temperature series
+    "INCOME_LEVELS": [],  # charts read the local glossary, refreshed separately
+    "DSA_LIST": ["gain"],
+}
+
+
+def _size_from_headers(headers) -> int | None:
+    """returns the full size of a resource from response headers"""
+
+    if "Content-Range" in headers:
+        total = headers["Content-Range"].split("/")[-1]
+        return int(total) if total.isdigit() else None
+
+    if "Content-Length" in headers:
+        return int(headers["Content-Length"])
+
+    return None
+
+
+def check_source(name: str, url: str) -> dict:
+    """Check reachability, content type and size of a source url
+
+    Args:
+        name (str): source name
+        url (str): source url
+
+    Returns:
+        dict
+    """
+
+    result = {"name": name, "url": url, "ok": False}
+
+    try:
+        response = requests.head(
+            url, headers=HEADERS, allow_redirects=True, timeout=TIMEOUT
+        )
+        if response.status_code >= 400:
+            response = requests.get(
+                url,
+                headers={**HEADERS, "Range": "bytes=0-0"},
+                stream=True,
+                timeout=TIMEOUT,
+            )
+            response.close()
+    except requests.RequestException as error:
+        result["error"] = str(error)
+        return result
+
+    content_type = response.headers.get("Content-Type", "").split(";")[0]
+    result.update(
+        status=response.status_code,
+        content_type=content_type,
+        size=_size_from_headers(response.headers),
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+
+    if response.status_code >= 400:
+        result["error"] = f"status {response.status_code}"
+    elif content_type == "text/html":
+        result["error"] = "returned HTML"
+    else:
+        result["ok"] = True
+
+    return result
+
+
+def check_sources() -> list:
+    """Check all sources in SOURCE_CHARTS concurrently"""
+
+    sources = {name: getattr(config.urls, name) for name in SOURCE_CHARTS}
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        return list(executor.map(check_source, sources, sources.values()))
+
+
+def _compare(result: dict, previous: dict) -> dict:
+    """note changes in content type and size compared to the previous run
+
+    Only HTML responses fail the check. A different content type is reported,
+    but the source is still updated and the new type becomes the reference.
+    """
+
+    if not result["ok"] or previous is None:
+        return result
+
+    if previous.get("content_type") not in (None, result["content_type"]):
+        result["warning"] = (
+            f"content type changed from {previous['content_type']} "
+            f"to {result['content_type']}"
+        )
+    if previous.get("size") and result["size"] is not None:
+        result["size_change"] = result["size"] - previous["size"]
+
+    return result
+
+
+def run_preflight(strict: bool = False) -> list:
+    """Check all sources and return the charts which cannot be updated
+
+    Args:
+        strict (bool): raise an error if any source fails. Default = False
+
+    Returns:
+        list of chart names to skip
+    """
+
+    path = f"{config.paths.raw_data}/preflight.json"
+    previous = {}
+    if os.path.exists(path):
+        with open(path) as file:
+            previous = json.load(file)
+
+    results = [_compare(r, previous.get(r["name"])) for r in check_sources()]
+
+    failed = [r for r in results if not r["ok"]]
+    for r in failed:
+        print(f"Preflight failed for {r['name']} ({r['url']}): {r['error']}")
+    for r in results:
+        if "warning" in r:
+            print(f"Preflight warning for {r['name']}: {r['warning']}")
+        if r.get("size_change"):
+            print(f"{r['name']} changed size by {r['size_change'] / 1e6:+.2f} MB")
+
+    if strict and len(failed) > 0:
+        raise ConnectionError(f"{len(failed)} source(s) failed the preflight check")
+
+    # only sources used by charts in the update pipeline are downloaded
+    expected = sum(
+        r["size"]
+        for r in results
+        if r["ok"]
+        and r["size"] is not None
+        and any(chart in charts.CHARTS for chart in SOURCE_CHARTS[r["name"]])
+    )
+    print(f"Preflight passed for {len(results) - len(failed)}/{len(results)} sources")
+    print(f"Expected download size: {expected / 1e6:.1f} MB")
+
+    # keep the last successful result of each source for the next comparison
+    previous.update({r["name"]: r for r in results if r["ok"]})
+    with open(path, "w") as file:
+        json.dump(previous, file, indent=2)
+
+    return sorted({chart for r in failed for chart in SOURCE_CHARTS[r["name"]]})
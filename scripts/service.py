@@ -0,0 +1,177 @@
+"""Local refresh service
+
+Keeps parsed sources and lookups warm in one long-running process, polls the
+sources on their own schedule, rebuilds only the charts whose sources changed
+and serves the chart csvs from the output folder over HTTP.
+
+Run with `python -m scripts.service`.
+"""
+
+import argparse
+import functools
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from scripts import charts, config, download_data, glossaries, preflight, store, utils
+
+# seconds between checks of the urls in config.Urls
+POLL_INTERVAL = 60 * 60
+
+# charts whose sources cannot be checked with a HEAD request (World Bank API)
+# are rebuilt on a fixed schedule, in seconds
+SCHEDULED_CHARTS = {
+    "electricity_cooking": 24 * 60 * 60,
+    "forest_congo": 24 * 60 * 60,
+}
+
+# charts built from the manually downloaded EM-DAT file
+EMDAT_CHARTS = ["climate_events", "climate_events_windows"]
+
+
+def rebuild(names: set | list) -> set:
+    """Re-ingest the store tables of some charts and rebuild them
+
+    Returns:
+        set of charts which were rebuilt successfully
+    """
+
+    built = set()
+    for name in [name for name in charts.CHARTS if name in names]:
+        try:
+            store.ingest_sources(charts.CHART_TABLES.get(name, []))
+            charts.CHARTS[name]()
+            built.add(name)
+            print(f"Rebuilt {name}")
+        except Exception as error:
+            print(f"Could not rebuild {name}: {error}")
+
+    return built
+
+
+class Refresher:
+    """Tracks source versions and rebuilds charts when they change
+
+    Versions are only recorded once all charts depending on them have been
+    rebuilt, so failed charts are retried on the next poll.
+    """
+
+    def __init__(self):
+        self.fingerprints = {}
+        self.last_built = {}
+        self.emdat_mtime = None
+
+    def changed_sources(self) -> dict:
+        """returns the new fingerprints of source urls which changed since the
+        last successful rebuild"""
+
+        changed = {}
+        for result in preflight.check_sources():
+            if not result["ok"]:
+                print(f"Could not check {result['name']}: {result['error']}")
+                continue
+            fingerprint = (
+                result["etag"],
+                result["last_modified"],
+                result["size"],
+            )
+            if self.fingerprints.get(result["name"]) != fingerprint:
+                changed[result["name"]] = fingerprint
+
+        return changed
+
+    def changed_emdat(self) -> float | None:
+        """returns the modification time of the local EM-DAT file if it changed
+        since the last successful rebuild, else None"""
+
+        path = f"{config.paths.raw_data}/emdat.xlsx"
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime == self.emdat_mtime:
+            return None
+
+        download_data.get_emdat_cube.cache_clear()
+        return mtime
+
+    def due_charts(self) -> set:
+        """returns the scheduled charts which are due for a rebuild"""
+
+        now = time.time()
+        due = {
+            name
+            for name, interval in SCHEDULED_CHARTS.items()
+            if now - self.last_built.get(name, 0) >= interval
+        }
+        if len(due) > 0:
+            utils.get_pop_panel.cache_clear()
+
+        return due
+
+    def refresh(self) -> None:
+        """Rebuild every chart with a changed or due source"""
+
+        try:
+            glossaries.refresh_income_levels()
+        except Exception as error:
+            print(f"Could not refresh income levels: {error}")
+
+        sources = self.changed_sources()
+        emdat_mtime = self.changed_emdat()
+        due = self.due_charts()
+
+        names = {c for source in sources for c in preflight.SOURCE_CHARTS[source]}
+        if emdat_mtime is not None:
+            names.update(EMDAT_CHARTS)
+        built = rebuild(names | due)
+
+        def rebuilt(names: list) -> bool:
+            return all(name in built for name in names if name in charts.CHARTS)
+
+        for source, fingerprint in sources.items():
+            if rebuilt(preflight.SOURCE_CHARTS[source]):
+                self.fingerprints[source] = fingerprint
+        if emdat_mtime is not None and rebuilt(EMDAT_CHARTS):
+            self.emdat_mtime = emdat_mtime
+        self.last_built.update({name: time.time() for name in due & built})
+
+
+def serve(port: int = 8000) -> ThreadingHTTPServer:
+    """Serve the output folder on localhost in a background thread"""
+
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=config.paths.output)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving charts on http://127.0.0.1:{port}")
+
+    return server
+
+
+def run(port: int = 8000, interval: int = POLL_INTERVAL) -> None:
+    """Serve chart csvs and refresh them until interrupted
+
+    Args:
+        port (int): local port to serve the output folder on. Default = 8000
+        interval (int): seconds between source checks. Default = 1 hour
+    """
+
+    server = serve(port)
+    refresher = Refresher()
+
+    try:
+        while True:
+            try:
+                refresher.refresh()
+            except Exception as error:
+                print(f"Refresh failed, retrying in {interval} seconds: {error}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--interval", type=int, default=POLL_INTERVAL)
+    args = parser.parse_args()
+
+    run(args.port, args.interval)
@@ -0,0 +1,210 @@
+"""Versioned snapshots of chart outputs
+
+Each run stores a manifest listing, for every output csv, its header and the
+hashes of its rows. Row contents are stored once, in a compressed pack written
+by the run which first produced them, so unchanged rows and files cost only
+their hashes (or a pointer to an earlier run) in later manifests.
+
+snapshots/
+    manifests/00001.json
+    packs/00001.json.gz
+"""
+
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+from functools import lru_cache
+from typing import Optional
+
+import pandas as pd
+
+from scripts import config
+
+
+def _manifest_path(run: int) -> str:
+    return f"{config.paths.snapshots}/manifests/{run:05d}.json"
+
+
+def _pack_path(run: int) -> str:
+    return f"{config.paths.snapshots}/packs/{run:05d}.json.gz"
+
+
+def list_runs() -> list:
+    """returns the run numbers of all snapshots"""
+
+    folder = f"{config.paths.snapshots}/manifests"
+    if not os.path.exists(folder):
+        return []
+
+    return sorted(int(name.split(".")[0]) for name in os.listdir(folder))
+
+
+@lru_cache
+def _read_manifest(run: int) -> dict:
+    with open(_manifest_path(run)) as file:
+        return json.load(file)
+
+
+@lru_cache
+def _read_pack(run: int) -> dict:
+    if not os.path.exists(_pack_path(run)):
+        return {}
+
+    with gzip.open(_pack_path(run), "rt") as file:
+        return json.load(file)
+
+
+def _split_rows(path: str) -> list:
+    """returns each record of a csv file as a normalized csv line"""
+
+    with open(path, newline="") as file:
+        records = list(csv.reader(file))
+
+    lines = []
+    for record in records:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(record)
+        lines.append(buffer.getvalue())
+
+    return lines
+
+
+def _hash(line: str) -> str:
+    return hashlib.sha1(line.encode()).hexdigest()[:16]
+
+
+def _resolve(run: int, filename: str) -> tuple[int, dict]:
+    """returns the run holding the rows of a file and its manifest entry"""
+
+    entry = _read_manifest(run)["files"].get(filename)
+    if entry is None:
+        raise ValueError(f"{filename} is not in snapshot {run}")
+
+    if "same_as" in entry:
+        return _resolve(entry["same_as"], filename)
+
+    return run, entry
+
+
+def take_snapshot(files: Optional[list] = None) -> int:
+    """Store a snapshot of the csv files in the output folder
+
+    Args:
+        files (list): file names to store. Default = all chart csv files
+
+    Returns:
+        int: run number of the snapshot
+    """
+
+    if files is None:
+        files = sorted(
+            f
+            for f in os.listdir(config.paths.output)
+            if f.endswith(".csv") and f != "updates.csv"
+        )
+
+    runs = list_runs()
+    run = runs[-1] + 1 if len(runs) > 0 else 1
+    previous = runs[-1] if len(runs) > 0 else None
+    known = set().union(*(_read_pack(r) for r in runs))
+
+    manifest = {"run": run, "timestamp": str(datetime.datetime.today()), "files": {}}
+    pack = {}
+    for filename in files:
+        lines = _split_rows(f"{config.paths.output}/{filename}")
+        header, rows = lines[0], [_hash(line) for line in lines[1:]]
+
+        if previous is not None:
+            try:
+                source_run, entry = _resolve(previous, filename)
+                if entry["header"] == header and entry["rows"] == rows:
+                    manifest["files"][filename] = {"same_as": source_run}
+                    continue
+            except ValueError:
+                pass
+
+        manifest["files"][filename] = {"header": header, "rows": rows}
+        pack.update({h: line for h, line in zip(rows, lines[1:]) if h not in known})
+
+    os.makedirs(os.path.dirname(_manifest_path(run)), exist_ok=True)
+    os.makedirs(os.path.dirname(_pack_path(run)), exist_ok=True)
+    with open(_manifest_path(run), "w") as file:
+        json.dump(manifest, file)
+    if len(pack) > 0:
+        with gzip.open(_pack_path(run), "wt") as file:
+            json.dump(pack, file)
+
+    print(f"Stored snapshot {run} ({len(pack)} new rows)")
+
+    return run
+
+
+def _rows(run: int, filename: str) -> tuple[str, list]:
+    """returns the header and row hashes of a file in a snapshot"""
+
+    _, entry = _resolve(run, filename)
+
+    return entry["header"], entry["rows"]
+
+
+def _to_df(header: str, hashes: list, run: int) -> pd.DataFrame:
+    """rebuild a dataframe from row hashes, using packs up to a run"""
+
+    contents = {}
+    for r in reversed(list_runs()):
+        if r > run:
+            continue
+        contents.update(_read_pack(r))
+        if all(h in contents for h in hashes):
+            break
+
+    text = header + "".join(contents[h] for h in hashes)
+
+    return pd.read_csv(io.StringIO(text))
+
+
+def read_snapshot(filename: str, run: Optional[int] = None) -> pd.DataFrame:
+    """Read an output file as of a snapshot
+
+    Args:
+        filename (str): output file name, e.g. "gain.csv"
+        run (int): run number. Default = latest run
+
+    Returns:
+        pd.DataFrame
+    """
+
+    if run is None:
+        run = list_runs()[-1]
+
+    header, hashes = _rows(run, filename)
+
+    return _to_df(header, hashes, run)
+
+
+def diff_snapshots(
+    filename: str, run_a: int, run_b: int
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Rows added and removed in an output file between two snapshots
+
+    Args:
+        filename (str): output file name, e.g. "gain.csv"
+        run_a (int): earlier run number
+        run_b (int): later run number
+
+    Returns:
+        tuple of dataframes with the added and the removed rows
+    """
+
+    header_a, hashes_a = _rows(run_a, filename)
+    header_b, hashes_b = _rows(run_b, filename)
+
+    set_a, set_b = set(hashes_a), set(hashes_b)
+    added = [h for h in hashes_b if h not in set_a]
+    removed = [h for h in hashes_a if h not in set_b]
+
+    return _to_df(header_b, added, run_b), _to_df(header_a, removed, run_a)
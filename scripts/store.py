@@ -0,0 +1,264 @@
+"""Embedded analytical store for ingested sources
+
+Sources are cleaned by their `download_data`/`utils` loaders and written once
+per run to a local SQLite database, indexed on (iso_code, year) where those
+columns exist. Charts then query the store with SQL so that filters and joins
+across sources run inside the engine.
+
+The time each table was ingested is kept in the `ingested` table. Tables
+ingested before the current process started are refreshed on first use.
+"""
+
+import sqlite3
+import time
+from contextlib import closing
+from typing import Callable, Optional
+
+import pandas as pd
+
+from scripts import utils, config
+from scripts.download_data import (
+    get_emdat,
+    get_minerals,
+    get_ndgain_data,
+    get_owid,
+    get_wpp,
+)
+
+
+def _income_levels() -> pd.DataFrame:
+    """income levels with normalized column names"""
+
+    return utils.get_income_levels().rename(
+        columns={"Code": "iso_code", "Income group": "income_level"}
+    )
+
+
+def _population() -> pd.DataFrame:
+    """latest population, from the cached population panel"""
+
+    return utils.get_pop_latest().loc[:, ["iso_code", "year", "population"]]
+
+
+def _wpp() -> pd.DataFrame:
+    """WPP demographic indicators with normalized key columns"""
+
+    return get_wpp().rename(columns={"ISO3_code": "iso_code", "Time": "year"})
+
+
+# name: (loader, index columns)
+SOURCES: dict[str, tuple[Callable[[], pd.DataFrame], tuple]] = {
+    "owid_co2": (
+        lambda: get_owid(config.urls.OWID_CO2_URL, config.OWID_CO2_INDICATORS),
+        ("iso_code", "year"),
+    ),
+    "owid_energy": (
+        lambda: get_owid(config.urls.OWID_ENERGY_URL, config.OWID_ENERGY_INDICATORS),
+        ("iso_code", "year"),
+    ),
+    "emdat": (lambda: get_emdat(start_year=1900), ("iso_code", "year")),
+    "ndgain": (get_ndgain_data, ("iso_code",)),
+    "ndgain_panel": (
+        lambda: get_ndgain_data(all_years=True),
+        ("iso_code", "year"),
+    ),
+    "wpp": (_wpp, ("iso_code", "year")),
+    "weo": (utils.get_weo_data, ("iso_code", "year")),
+    "population": (_population, ("iso_code", "year")),
+    "forest_area": (
+        lambda: utils.get_wb_indicator("AG.LND.FRST.ZS"),
+        ("iso_code", "year"),
+    ),
+    "income_levels": (_income_levels, ("iso_code",)),
+    "minerals": (lambda: get_minerals(config.TRANSITION_MINERALS), ("country",)),
+}
+
+# start of the current run. Tables ingested earlier are refreshed by ensure
+RUN_STARTED = time.time()
+
+
+def connect() -> sqlite3.Connection:
+    """Open a connection to the local database"""
+
+    return sqlite3.connect(config.paths.database)
+
+
+def tables() -> list:
+    """returns the names of tables in the store"""
+
+    with closing(connect()) as con:
+        rows = con.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        return [row[0] for row in rows]
+
+
+def ingest(
+    df: pd.DataFrame,
+    name: str,
+    index: tuple = ("iso_code", "year"),
+    if_exists: str = "replace",
+) -> None:
+    """Write a dataframe to the store
+
+    Args:
+        df (pd.DataFrame): dataframe to store
+        name (str): table name
+        index (tuple): columns to index on. Columns not in df are ignored
+        if_exists (str): "replace" an existing table or "append" to it
+    """
+
+    index = [col for col in index if col in df.columns]
+
+    with closing(connect()) as con, con:
+        df.to_sql(name, con, if_exists=if_exists, index=False)
+        if len(index) > 0:
+            columns = ", ".join(f'"{col}"' for col in index)
+            con.execute(
+                f'CREATE INDEX IF NOT EXISTS "ix_{name}" ON "{name}" ({columns})'
+            )
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS ingested (name TEXT PRIMARY KEY, time REAL)"
+        )
+        con.execute("REPLACE INTO ingested VALUES (?, ?)", (name, time.time()))
+
+
+def ingested() -> dict:
+    """returns the time (seconds since the epoch) each table was ingested"""
+
+    if "ingested" not in tables():
+        return {}
+
+    with closing(connect()) as con:
+        return dict(con.execute("SELECT name, time FROM ingested").fetchall())
+
+
+def ingest_sources(names: Optional[list] = None) -> None:
+    """Download, clean and store sources
+
+    Args:
+        names (list): sources to ingest. Default = all sources
+    """
+
+    if names is None:
+        names = list(SOURCES)
+
+    for name in names:
+        if name not in SOURCES:
+            raise ValueError(f"{name} is not a valid source")
+        loader, index = SOURCES[name]
+        ingest(loader(), name, index)
+        print(f"Successfully ingested {name}")
+
+
+def ensure(names: list) -> None:
+    """Ingest sources which are not in the store or were ingested before the
+    current run started"""
+
+    times = ingested()
+    outdated = [name for name in names if times.get(name, 0) < RUN_STARTED]
+    if len(outdated) > 0:
+        ingest_sources(outdated)
+
+
+def query(sql: str, params: Optional[tuple | dict] = None) -> pd.DataFrame:
+    """Run a SQL query against the store
+
+    Args:
+        sql (str): query to run
+        params (tuple | dict): query parameters
+
+    Returns:
+        pd.DataFrame
+    """
+
+    with closing(connect()) as con:
+        return pd.read_sql_query(sql, con, params=params)
+
+
+# ==============================================
+# WEO vintages
+# ==============================================
+
+
+def ingest_weo_vintages(vintages: Optional[list] = None, refresh: bool = False) -> None:
+    """Add WEO vintages which are not yet in the store
+
+    Only missing vintages are downloaded and parsed. Vintages which cannot be
+    downloaded yet (e.g. a release announced but not published) are skipped.
+
+    Args:
+        vintages (list): (year, release) tuples. Default = all vintages since
+            utils.WEO_FIRST_VINTAGE
+        refresh (bool): parse vintages again even if they are stored
+    """
+
+    if vintages is None:
+        vintages = utils.weo_vintages()
+
+    stored = []
+    if "weo_vintages" in tables():
+        stored = query("SELECT DISTINCT vintage FROM weo_vintages").vintage.tolist()
+
+    for year, release in vintages:
+        vintage = f"{year}_{release}"
+        if vintage in stored and not refresh:
+            continue
+        try:
+            df = (
+                utils.get_weo_data(year, release)
+                .dropna(subset=["value"])
+                .loc[:, ["indicator", "iso_code", "year", "value"]]
+                .assign(vintage=vintage)
+            )
+        except Exception as error:
+            print(f"Could not read WEO {vintage}: {error}")
+            continue
+
+        if vintage in stored:
+            with closing(connect()) as con, con:
+                con.execute("DELETE FROM weo_vintages WHERE vintage = ?", (vintage,))
+        ingest(
+            df,
+            "weo_vintages",
+            ("indicator", "vintage", "iso_code", "year"),
+            if_exists="append",
+        )
+        print(f"Successfully ingested WEO {vintage}")
+
+
+def get_weo_vintages(
+    indicator: str, vintages: Optional[list] = None, years: Optional[list] = None
+) -> pd.DataFrame:
+    """Values of a WEO indicator in several vintages, side by side
+
+    Args:
+        indicator (str): WEO subject code, e.g. "NGDPD"
+        vintages (list): (year, release) tuples. Default = all vintages since
+            utils.WEO_FIRST_VINTAGE
+        years (list): years to return. Default = all years
+
+    Returns:
+        pd.DataFrame with iso_code and year columns and one column per vintage
+    """
+
+    if vintages is None:
+        vintages = utils.weo_vintages()
+    ingest_weo_vintages(vintages)
+
+    labels = [f"{year}_{release}" for year, release in vintages]
+    sql = f"""
+        SELECT iso_code, year, vintage, value
+        FROM weo_vintages
+        WHERE indicator = ? AND vintage IN ({", ".join("?" * len(labels))})
+        """
+    params = [indicator] + labels
+    if years is not None:
+        sql += f" AND year IN ({', '.join('?' * len(years))})"
+        params += list(years)
+
+    return (
+        query(sql, tuple(params))
+        .pivot(index=["iso_code", "year"], columns="vintage", values="value")
+        .reindex(columns=labels)
+        .reset_index()
+        .rename_axis(columns=None)
+    )
@@ -1,15 +1,21 @@
 """Utility functions"""
 
-from scripts import config
+from scripts import config, glossaries
 import wbgapi as wb
 import pandas as pd
 import numpy as np
 import weo
 import country_converter as coco
 from zipfile import ZipFile
+from functools import lru_cache
+from typing import Callable
 import io
+import json
+import os
 import requests
 import camelot
+from concurrent.futures import ProcessPoolExecutor
+from PyPDF2 import PdfReader
 
 
 def unzip_folder(url) -> ZipFile:
@@ -29,37 +35,34 @@ def unzip_folder(url) -> ZipFile:
 
 
 def add_flourish_geometries(
-    df: pd.DataFrame, key_column_name: str = "iso_code"
+    df: pd.DataFrame, key_column_name: str = "iso_code", keep: list | None = None
 ) -> pd.DataFrame:
     """
     Adds a geometry column to a dataframe based on iso3 code
         df: DataFrame to add a column
         key_column_name: name of column with iso3 codes to merge on, default = 'iso_code'
+        keep: iso3 codes of the geometries to keep, default = all geometries
     """
 
-    g = pd.read_json(f"{config.paths.glossaries}/flourish_geometries_world.json")
-    g = (
-        g.rename(columns={g.columns[0]: "flourish_geom", g.columns[1]: key_column_name})
-        .iloc[1:]
-        .drop_duplicates(subset=key_column_name, keep="first")
-        .reset_index(drop=True)
-    )
+    g = glossaries.flourish_geometries()
+    if keep is not None:
+        g = g.loc[g.iso_code.isin(keep)]
+    g = g.rename(columns={"iso_code": key_column_name})
 
     return pd.merge(g, df, on=key_column_name, how="left")
 
 
 def highlight_category(
     df: pd.DataFrame, column: str, keep_value: str, new_column: bool = False
-):
-    """ """
+) -> pd.DataFrame:
+    """
+    Sets all values other than keep_value to NaN
+        new_column: write the result to a new column named keep_value
+    """
 
-    if new_column:
-        df[keep_value] = df[column]
-        df.loc[df[keep_value] != keep_value, keep_value] = np.nan
-    else:
-        df.loc[df[column] != keep_value, column] = np.nan
+    highlighted = df[column].where(df[column] == keep_value)
 
-    return df
+    return df.assign(**{keep_value if new_column else column: highlighted})
 
 
 def remove_unnamed_cols(df: pd.DataFrame) -> pd.DataFrame:
@@ -86,6 +89,50 @@ def get_latest(
     return df.sort_values(by=by + [date_col]).groupby(by, as_index=False).last()
 
 
+def rank_by_year(
+    df: pd.DataFrame,
+    value_col: str,
+    year_col: str | None = "year",
+    id_col: str = "iso_code",
+    ascending: bool = False,
+) -> pd.DataFrame:
+    """
+    Adds a 'rank' column ranking value_col within each year and a 'rank_change'
+    column with the change in rank from the year before (negative values mean
+    moving up the ranking). rank_change is empty when the previous year is
+    missing. Rows keep their input order; ties are ranked by id_col
+        year_col: column with years. If None, the whole dataframe is ranked
+        ascending: rank lowest values first, default = False
+    """
+
+    if year_col is None:
+        ranks = (
+            df[value_col]
+            .reset_index(drop=True)
+            .loc[df[id_col].reset_index(drop=True).sort_values(kind="stable").index]
+            .rank(method="first", ascending=ascending)
+            .sort_index()
+        )
+        return df.assign(rank=ranks.astype("Int64").set_axis(df.index))
+
+    keys = df[[id_col, year_col]].reset_index(drop=True)
+    ranks = (
+        df[value_col]
+        .reset_index(drop=True)
+        .loc[keys.sort_values([id_col, year_col], kind="stable").index]
+        .groupby(keys[year_col])
+        .rank(method="first", ascending=ascending)
+        .sort_index()
+    )
+    previous = keys.assign(**{year_col: keys[year_col] + 1, "previous": ranks})
+    previous = keys.merge(previous, on=[id_col, year_col], how="left").previous
+
+    return df.assign(
+        rank=ranks.astype("Int64").set_axis(df.index),
+        rank_change=(ranks - previous).astype("Int64").set_axis(df.index),
+    )
+
+
 def keep_countries(
     df: pd.DataFrame, mapping_col: str = "iso_code", mapper="ISO3"
 ) -> pd.DataFrame:
@@ -95,6 +142,70 @@ def keep_countries(
     return df[df[mapping_col].isin(cc.data[mapper])].reset_index(drop=True)
 
 
+@lru_cache
+def _country_lookup(by: str) -> dict:
+    """returns a mapping of iso3 codes to a country_converter column"""
+
+    cc = coco.CountryConverter()
+    if by not in cc.data.columns:
+        raise ValueError(f"{by} is not valid")
+
+    return cc.data.drop_duplicates("ISO3").set_index("ISO3")[by].to_dict()
+
+
+@lru_cache
+def _iso3_lookup(by: str) -> dict:
+    """returns a mapping of a country_converter code column to iso3 codes"""
+
+    cc = coco.CountryConverter()
+    if by not in cc.data.columns:
+        raise ValueError(f"{by} is not valid")
+
+    return (
+        cc.data.dropna(subset=[by]).drop_duplicates(by).set_index(by)["ISO3"].to_dict()
+    )
+
+
+def codes_to_iso3(codes: pd.Series, by: str = "ISOnumeric") -> pd.Series:
+    """
+    Converts country codes to iso3 codes
+        by: country_converter code column, default = 'ISOnumeric'
+    """
+
+    return codes.map(_iso3_lookup(by))
+
+
+def countries_in(values: list, by: str = "continent") -> list:
+    """returns the iso3 codes of countries in a list of regions"""
+
+    return [iso for iso, region in _country_lookup(by).items() if region in values]
+
+
+def add_country_names(
+    df: pd.DataFrame,
+    iso_col: str = "iso_code",
+    name_col: str = "country",
+    to: str = "name_short",
+) -> pd.DataFrame:
+    """
+    Adds a country name column to a dataframe based on iso3 code
+        to: country_converter name column, default = 'name_short'
+    """
+
+    return df.assign(**{name_col: df[iso_col].map(_country_lookup(to))})
+
+
+def add_region(
+    df: pd.DataFrame, by: str = "continent", iso_col: str = "iso_code"
+) -> pd.DataFrame:
+    """
+    Adds a region column to a dataframe based on iso3 code
+        by: region category -'continent', UNregion etc.
+    """
+
+    return df.assign(**{by: df[iso_col].map(_country_lookup(by))})
+
+
 def filter_countries(
     df: pd.DataFrame,
     by: str = "continent",
@@ -107,12 +218,35 @@ def filter_countries(
         values: list of values to keep
     """
 
-    cc = coco.CountryConverter()
-    if by not in cc.data.columns:
-        raise ValueError(f"{by} is not valid")
+    mask = df[iso_col].map(_country_lookup(by)).isin(values)
+    return df[mask].reset_index(drop=True)
 
-    df[by] = coco.convert(df[iso_col], to=by)
-    return df[df[by].isin(values)].drop(columns=by).reset_index(drop=True)
+
+def write_regions(
+    df: pd.DataFrame,
+    name: str,
+    regions: list | tuple | None = None,
+    by: str = "continent",
+    iso_col: str = "iso_code",
+    enrich: Callable[[pd.DataFrame, str], pd.DataFrame] | None = None,
+) -> None:
+    """
+    Writes one csv per region to the output folder as "{name}_{region}.csv"
+        regions: regions to write, default = all regions in the dataframe
+        by: region category -'continent', UNregion etc.
+        enrich: function called with the rows and name of each region just
+            before writing, to add labels or geometries to written rows only
+    """
+
+    df = add_region(df, by, iso_col)
+    for region, group in df.groupby(by, sort=False):
+        if regions is not None and region not in regions:
+            continue
+        group = group.drop(columns=by).reset_index(drop=True)
+        if enrich is not None:
+            group = enrich(group, region)
+        region_name = str(region).lower().replace(" ", "_")
+        group.to_csv(f"{config.paths.output}/{name}_{region_name}.csv", index=False)
 
 
 # ============================================================================
@@ -121,28 +255,15 @@ def filter_countries(
 
 
 def get_income_levels() -> pd.DataFrame:
-    """Downloads fresh version of income levels from WB"""
-    url = "https://databank.worldbank.org/data/download/site-content/CLASS.xlsx"
-
-    df = pd.read_excel(
-        url,
-        sheet_name="List of economies",
-        usecols=["Code", "Income group"],
-        na_values=None,
-    )
+    """Returns income levels from the local glossary"""
 
-    df = df.dropna(subset=["Income group"])
-
-    return df
+    return glossaries.income_levels().reset_index()
 
 
 def add_income_levels(df: pd.DataFrame, iso_col: str = "iso_code") -> pd.DataFrame:
     """Add income levels to a dataframe"""
 
-    income_levels = (
-        get_income_levels().set_index("Code").loc[:, "Income group"].to_dict()
-    )
-    return df.assign(income_level=lambda d: d[iso_col].map(income_levels))
+    return df.assign(income_level=lambda d: d[iso_col].map(glossaries.income_levels()))
 
 
 # ===================================================
@@ -150,10 +271,13 @@ def add_income_levels(df: pd.DataFrame, iso_col: str = "iso_code") -> pd.DataFra
 # ===================================================
 
 
-def _download_wb_data(code: str, database: int = 2) -> pd.DataFrame:
+def _download_wb_data(
+    code: str, database: int = 2, most_recent_only: bool = True
+) -> pd.DataFrame:
     """
     Queries indicator from World Bank API
         default database = 2 (World Development Indicators)
+        most_recent_only: only query the most recent non-empty value, default = True
     """
 
     try:
@@ -162,7 +286,7 @@ def _download_wb_data(code: str, database: int = 2) -> pd.DataFrame:
             db=database,
             numericTimeKeys=True,
             labels=True,
-            mrnev=1,
+            mrnev=1 if most_recent_only else None,
         )
         return df
 
@@ -180,14 +304,17 @@ def _melt_wb_data(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def get_wb_indicator(code: str, database: int = 2) -> pd.DataFrame:
+def get_wb_indicator(
+    code: str, database: int = 2, most_recent_only: bool = True
+) -> pd.DataFrame:
     """
     Steps to extract and clean an indicator from World Bank
         code: indicator code
         database: database number, default = 2 (World Development Indicators)
+        most_recent_only: only query the most recent non-empty value, default = True
     """
 
-    df = _download_wb_data(code, database).pipe(_melt_wb_data)
+    df = _download_wb_data(code, database, most_recent_only).pipe(_melt_wb_data)
     print(f"Successfully extracted {code} from World Bank")
 
     return df
@@ -202,42 +329,102 @@ def get_pop():
     # .pipe(get_latest, ['iso_code', 'country_name'], date_col='year'))
 
 
+@lru_cache
+def get_pop_panel() -> pd.DataFrame:
+    """
+    Returns population for all countries and years, sorted by year.
+    The panel is downloaded once and cached for the rest of the session
+    """
+
+    return (
+        get_wb_indicator("SP.POP.TOTL", most_recent_only=False)
+        .dropna(subset="value")
+        .loc[:, ["iso_code", "year", "value"]]
+        .rename(columns={"value": "population"})
+        .astype({"year": "int64"})
+        .sort_values("year")
+        .reset_index(drop=True)
+    )
+
+
 def get_pop_latest():
     """ """
 
-    return get_pop().pipe(get_latest, ["iso_code", "country_name"], date_col="year")
+    return get_pop_panel().pipe(get_latest, "iso_code", date_col="year")
 
 
 def add_pop_latest(df: pd.DataFrame, iso_col="iso_code") -> pd.DataFrame:
     """ """
 
-    pop = get_pop_latest().set_index("iso_code")["value"].to_dict()
-    df["population"] = df[iso_col].map(pop)
+    pop = get_pop_latest().set_index("iso_code")["population"].to_dict()
+
+    return df.assign(population=lambda d: d[iso_col].map(pop))
+
+
+def _population_for(
+    df: pd.DataFrame, iso_col: str, year_col: str | None, nearest: bool
+) -> np.ndarray:
+    """returns the population matching each row of df"""
+
+    if year_col is None:
+        pop = get_pop_latest().set_index("iso_code")["population"]
+        return df[iso_col].map(pop).to_numpy()
+
+    # rows without a year get no population
+    keys = pd.DataFrame(
+        {
+            "iso_code": df[iso_col].to_numpy(),
+            "year": df[year_col].to_numpy(),
+            "position": np.arange(len(df)),
+        }
+    ).dropna(subset=["year"])
+    merged = pd.merge_asof(
+        keys.astype({"year": "int64"}).sort_values("year"),
+        get_pop_panel(),
+        on="year",
+        by="iso_code",
+        direction="nearest" if nearest else "backward",
+    )
 
-    return df
+    return merged.set_index("position")["population"].reindex(range(len(df))).to_numpy()
 
 
 def per_capita(
     df: pd.DataFrame,
-    target_col: str,
+    target_col: str | list,
     new_column=True,
     percent=False,
     iso_col="iso_code",
+    year_col: str | None = None,
+    nearest: bool = False,
+    scale: float = 1,
 ) -> pd.DataFrame:
-    """standardize a column by population"""
+    """
+    standardize one or more columns by population
+        target_col: column or list of columns to standardize
+        percent: express values as a percentage of population
+        year_col: column with years to align population to. Each row uses the
+            population of the same year or, if missing, the latest earlier year.
+            If None, the latest population is used
+        nearest: use the population of the nearest year instead of the latest
+            earlier year
+        scale: value multiplier, e.g. 1000 for values per 1,000 people. Cannot
+            be combined with percent
+    """
 
-    df = add_pop_latest(df, iso_col)
+    if isinstance(target_col, str):
+        target_col = [target_col]
     if percent:
-        calc_series = (df[target_col] / df["population"]) * 100
-    else:
-        calc_series = df[target_col] / df["population"]
+        if scale != 1:
+            raise ValueError("percent and scale cannot be used together")
+        scale = 100
 
-    if new_column:
-        df[target_col + "_per_capita"] = calc_series
-    else:
-        df[target_col] = calc_series
+    population = _population_for(df, iso_col, year_col, nearest)
+    suffix = "_per_capita" if new_column else ""
 
-    return df.drop(columns="population")
+    return df.assign(
+        **{col + suffix: df[col].to_numpy() / population * scale for col in target_col}
+    )
 
 
 # ==========================================
@@ -247,6 +434,15 @@ def per_capita(
 WEO_YEAR = 2022
 WEO_RELEASE = 1
 
+# first (year, release) WEO vintage kept for comparison
+WEO_FIRST_VINTAGE = (2022, 1)
+
+
+def weo_vintages(first: tuple = WEO_FIRST_VINTAGE) -> list:
+    """returns the (year, release) of WEO vintages published since first"""
+
+    return [vintage for vintage in weo.all_releases() if vintage >= first]
+
 
 def _download_weo(year: int = WEO_YEAR, release: int = WEO_RELEASE) -> None:
     """Downloads WEO as a csv to raw data folder as "weo_month_year.csv"""
@@ -284,8 +480,8 @@ def _clean_weo(df: pd.DataFrame) -> pd.DataFrame:
         .rename(columns=columns)
         .melt(id_vars=columns.values(), var_name="year", value_name="value")
         .assign(
-            value=lambda d: d.value.map(
-                lambda x: str(x).replace(",", "").replace("-", "")
+            value=lambda d: d.value.map(lambda x: str(x).replace(",", "")).replace(
+                {"--": np.nan, "n/a": np.nan}
             )
         )
         .astype({"year": "int32"})
@@ -293,15 +489,28 @@ def _clean_weo(df: pd.DataFrame) -> pd.DataFrame:
     )
 
 
+def get_weo_data(year: int = WEO_YEAR, release: int = WEO_RELEASE) -> pd.DataFrame:
+    """
+    Reads a WEO file and returns a clean dataframe.
+    The file is downloaded to the raw data folder if it is not there yet
+    """
+
+    path = f"{config.paths.raw_data}/weo_{year}_{release}.csv"
+    if not os.path.exists(path):
+        _download_weo(year, release)
+
+    df = weo.WEO(path).df
+
+    return df.pipe(_clean_weo)
+
+
 def get_weo_indicator(indicator: str) -> pd.DataFrame:
     """
     Retrieves values for an indicator for a target year
     """
 
-    df = weo.WEO(f"{config.paths.raw_data}/weo_{WEO_YEAR}_{WEO_RELEASE}.csv").df
-
     df = (
-        df.pipe(_clean_weo)
+        get_weo_data()
         .dropna(subset=["value"])
         .loc[
             lambda d: (d.indicator == indicator),
@@ -354,9 +563,7 @@ def add_gdp_latest(
     gdp_df = get_gdp_latest(year=year, per_capita=per_capita)
     gdp_dict = gdp_df.set_index("iso_code")["value"].to_dict()
 
-    df[new_col_name] = df[iso_col].map(gdp_dict)
-
-    return df
+    return df.assign(**{new_col_name: df[iso_col].map(gdp_dict)})
 
 
 # ==============================================
@@ -364,6 +571,10 @@ def add_gdp_latest(
 # ==============================================
 
 
+# risk ratings in the DSA list ("…" when there is no rating)
+DEBT_DISTRESS_RATINGS = ["Low", "Moderate", "High", "In debt distress", "…"]
+
+
 def __download_pdf(url: str, local_path: str) -> None:
     """Downloads the a pdf to the file"""
 
@@ -375,27 +586,64 @@ def __download_pdf(url: str, local_path: str) -> None:
         raise ConnectionError("Could not download PDF")
 
 
+def _read_pdf_page(local_path: str, page: int) -> list:
+    """Reads all tables in a page of a pdf"""
+
+    tables = camelot.read_pdf(local_path, flavor="stream", pages=str(page))
+
+    return [table.df for table in tables]
+
+
+def __check_layout(tables: list) -> None:
+    """Checks that the tables have the expected country and debt distress columns"""
+
+    header = tables[0].head(10)
+    if (
+        header.shape[1] < 3
+        or not header[0].str.contains("Country").any()
+        or not header[2].str.contains("debt").any()
+    ):
+        raise ValueError("Unexpected PDF layout. Check PDF")
+
+
 def __pdf_to_df(local_path: str) -> pd.DataFrame:
-    """Reads a pdf and returns a dataframe"""
+    """Reads all pages of a pdf in parallel and returns a single dataframe with
+    the country (0) and debt distress (2) columns"""
 
-    try:
-        tables = camelot.read_pdf(local_path, flavor="stream")
-        if len(tables) != 1:
-            raise ValueError("There is more than 1 page. Check PDF")
+    pages = range(1, len(PdfReader(local_path).pages) + 1)
 
-        return tables[0].df
+    if len(pages) == 1:
+        page_tables = [_read_pdf_page(local_path, 1)]
+    else:
+        workers = min(len(pages), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            page_tables = list(
+                pool.map(_read_pdf_page, [local_path] * len(pages), pages)
+            )
 
-    except ValueError:
+    tables = [table for page in page_tables for table in page]
+    if len(tables) == 0:
         raise ValueError("Could not read PDF to a dataframe")
+    __check_layout(tables)
+
+    # continuation pages can be read with extra or missing trailing columns
+    tables = [table.loc[:, [0, 2]] for table in tables if table.shape[1] >= 3]
+
+    return pd.concat(tables, ignore_index=True).drop_duplicates(ignore_index=True)
 
 
 def __clean_df(df: pd.DataFrame) -> pd.DataFrame:
     """Cleans the dataframe"""
 
     return (
-        df.filter([0, 2], axis=1)
-        .rename(columns={0: "country", 2: "debt_distress"})
-        .assign(iso_code=lambda d: coco.convert(d.country))
+        df.rename(columns={0: "country", 2: "debt_distress"})
+        .assign(
+            country=lambda d: d.country.str.strip(),
+            debt_distress=lambda d: d.debt_distress.str.strip(),
+        )
+        # drop header and footnote rows, which have no risk rating
+        .loc[lambda d: d.debt_distress.isin(DEBT_DISTRESS_RATINGS)]
+        .assign(iso_code=lambda d: glossaries.to_iso3(d.country, source="imf_dsa"))
         .loc[lambda d: d.iso_code != "not found"]
         .reset_index(drop=True)
         .filter(["iso_code", "debt_distress"], axis=1)
@@ -406,10 +654,9 @@ def __clean_df(df: pd.DataFrame) -> pd.DataFrame:
 def get_debt_distress():
     """Downloads and reads debt distress"""
 
-    url = "https://www.imf.org/external/Pubs/ft/dsa/DSAlist.pdf"
     pdf_path = f"{config.paths.raw_data}/dsa.pdf"
 
-    __download_pdf(url, pdf_path)
+    __download_pdf(config.urls.DSA_LIST, pdf_path)
     df = __pdf_to_df(pdf_path).pipe(__clean_df)
 
     return df
@@ -422,3 +669,104 @@ def add_debt_distress(df: pd.DataFrame, iso_col: str = "iso_code") -> pd.DataFra
     return df.assign(
         debt_distress=lambda d: d[iso_col].map(debt_distress["debt_distress"])
     )
+
+
+# ==============================================
+# Grid masks
+# ==============================================
+
+
+def download_file(url: str, local_path: str, chunk_size: int = 2**20) -> None:
+    """Streams a file to disk without holding it in memory"""
+
+    try:
+        with requests.get(url, stream=True) as response:
+            response.raise_for_status()
+            with open(local_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+    except ConnectionError:
+        raise ConnectionError(f"Could not download {url}")
+
+
+def _points_in_polygon(
+    x: np.ndarray, y: np.ndarray, polygon: list, batch: int = 1000
+) -> np.ndarray:
+    """Even-odd test of points against a GeoJSON polygon (outer ring and holes)"""
+
+    inside = np.zeros(len(x), dtype=bool)
+    for ring in polygon:
+        ring = np.asarray(ring)
+        x1, y1, x2, y2 = ring[:-1, 0], ring[:-1, 1], ring[1:, 0], ring[1:, 1]
+        for start in range(0, len(x), batch):
+            px = x[start : start + batch, None]
+            py = y[start : start + batch, None]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crosses = ((y1 > py) != (y2 > py)) & (
+                    px < (x2 - x1) * (py - y1) / (y2 - y1) + x1
+                )
+            inside[start : start + batch] ^= crosses.sum(axis=1) % 2 == 1
+
+    return inside
+
+
+def _build_grid_masks(lat: np.ndarray, lon: np.ndarray, samples: int) -> np.ndarray:
+    """Fraction of each grid cell covered by each country in the Flourish geometries"""
+
+    offsets = (np.arange(samples) + 0.5) / samples - 0.5
+    sub_lat = (lat[:, None] + offsets * abs(lat[1] - lat[0])).ravel()
+    sub_lon = (lon[:, None] + offsets * abs(lon[1] - lon[0])).ravel()
+    x, y = (a.ravel() for a in np.meshgrid(sub_lon, sub_lat))
+
+    masks = []
+    for geometry in glossaries.flourish_geometries().flourish_geom:
+        geometry = json.loads(geometry)
+        polygons = geometry["coordinates"]
+        if geometry["type"] == "Polygon":
+            polygons = [polygons]
+
+        inside = np.zeros(len(x), dtype=bool)
+        for polygon in polygons:
+            outer = np.asarray(polygon[0])
+            candidates = np.flatnonzero(
+                (x >= outer[:, 0].min())
+                & (x <= outer[:, 0].max())
+                & (y >= outer[:, 1].min())
+                & (y <= outer[:, 1].max())
+            )
+            inside[candidates] |= _points_in_polygon(
+                x[candidates], y[candidates], polygon
+            )
+        masks.append(
+            inside.reshape(len(lat), samples, len(lon), samples).mean(axis=(1, 3))
+        )
+
+    return np.stack(masks).astype("float32")
+
+
+def get_grid_masks(
+    lat: np.ndarray, lon: np.ndarray, samples: int = 5
+) -> tuple[list, np.ndarray]:
+    """
+    Returns iso3 codes and an array (country, lat, lon) with the fraction of each
+    grid cell covered by each country. Cell centres are given by lat and lon and
+    each cell is sampled samples x samples times. Masks are built once and cached
+    in the raw data folder
+    """
+
+    path = f"{config.paths.raw_data}/grid_masks.npz"
+    iso_codes = glossaries.flourish_geometries().iso_code.tolist()
+
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            if (
+                np.array_equal(cached["lat"], lat)
+                and np.array_equal(cached["lon"], lon)
+                and cached["iso_codes"].tolist() == iso_codes
+            ):
+                return iso_codes, cached["masks"]
+
+    masks = _build_grid_masks(lat, lon, samples)
+    np.savez_compressed(path, lat=lat, lon=lon, iso_codes=iso_codes, masks=masks)
+
+    return iso_codes, masks
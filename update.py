@@ -1,6 +1,8 @@
 """Update page charts"""
 
 from scripts.charts import update_charts
+from scripts.preflight import run_preflight
+from scripts.snapshots import take_snapshot
 from csv import writer
 from scripts import config
 import datetime
@@ -18,7 +20,9 @@ def log_update() -> None:
 
 if __name__ == "__main__":
 
-    update_charts()  # update charts
+    skip = run_preflight()  # check sources before downloading
+    update_charts(skip=skip, memory_budget_mb=config.MEMORY_BUDGET_MB)  # update
     log_update()  # Log update
+    take_snapshot()  # store a versioned copy of the outputs
 
 